@@ -1,7 +1,15 @@
 import os
+import re
 import shlex
+import signal
+import stat
 import subprocess
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import CDLL
+from functools import cache, lru_cache
+from itertools import accumulate
 from pathlib import Path
 
 # For GTK4 Layer Shell to get linked before libwayland-client
@@ -14,45 +22,135 @@ gi.require_version("Gdk", "4.0")
 gi.require_version("Gtk", "4.0")
 gi.require_version("Gtk4LayerShell", "1.0")
 
-from gi.repository import Gdk, Gtk
+from gi.repository import Gdk, GLib, Gtk
 from gi.repository import Gtk4LayerShell as LayerShell
 
 APP_NAME = "proslenkey"
 CSS_FILE = "style.css"
+CONFIG_PATH = Path(os.getenv("XDG_CONFIG_HOME", Path.home() / ".config")) / APP_NAME
+MAX_SUGGESTIONS = 20
+REFRESH_DELAY_MS = 30
+
+# Characters that make a command line rely on shell syntax
+SHELL_CHARS = frozenset("|&;<>()$`*?[~{#\n")
+
+# Fallback default CSS
+DEFAULT_CSS = b"""
+    window {
+        min-height: 50px;
+    }
+
+    entry {
+        min-width: 500px;
+        font-size: 18px;
+        font-weight: bold;
+        border: 2px solid rgb(0, 129, 194);
+        outline-color: rgba(0, 0, 0, 0);
+        border-radius: 10px;
+    }
+
+    button {
+        font-size: 18px;
+        font-weight: bold;
+        border-radius: 18px;
+    }
+
+    button:focus {
+        border: 2px solid rgb(0, 129, 194);
+        outline-color: rgba(0, 0, 0, 0);
+    }
+"""
+
+
+def get_dir_commands(p: str) -> set[str]:
+    """Return executable filenames in directory `p`."""
+    commands: set[str] = set()
+    try:
+        with os.scandir(p) as entries:
+            for entry in entries:
+                try:
+                    mode = entry.stat().st_mode
+                except OSError:
+                    continue
+                if stat.S_ISREG(mode) and mode & 0o111:
+                    commands.add(entry.name)
+    except OSError:
+        pass
+    return commands
 
 
 def get_path_commands() -> list[str]:
     """Return executable filenames from PATH, sorted with shorter names first."""
-    commands: set[str] = set()
-    for p in (Path(p) for p in os.getenv("PATH", "").split(os.pathsep)):
-        if not p or not p.is_dir():
+    # Skip repeated PATH entries, including different paths to the same directory
+    dirs: list[str] = []
+    seen: set[tuple[int, int]] = set()
+    for p in dict.fromkeys(os.getenv("PATH", "").split(os.pathsep)):
+        # `Path("")` is the current directory, which PATH scanning skips
+        if not p:
             continue
-        for f in p.iterdir():
-            if f.is_file() and os.access(f, os.X_OK):
-                commands.add(f.name)
-    return sorted(commands, key=lambda c: (len(c), c))
-
+        try:
+            st = Path(p).stat()
+        except OSError:
+            continue
+        if (st.st_dev, st.st_ino) not in seen:
+            seen.add((st.st_dev, st.st_ino))
+            dirs.append(p)
 
-def get_config_path() -> Path:
-    """Return config path."""
-    return (
-        Path(
-            os.getenv("XDG_CONFIG_HOME", Path.home() / ".config"),
-        )
-        / APP_NAME
+    commands: set[str] = set()
+    # Directory scans are I/O bound, so run them concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for dir_commands in executor.map(get_dir_commands, dirs):
+            commands |= dir_commands
+    decorated = [(len(c), c) for c in commands]
+    decorated.sort()
+    return [c for _, c in decorated]
+
+
+def index_commands() -> tuple[list[str], str, array]:
+    """Return PATH commands, their lowercased lines joined, and line offsets."""
+    # Lines of the joined string are separated by newlines
+    commands = [cmd for cmd in get_path_commands() if "\n" not in cmd]
+    lowered = [cmd.lower() for cmd in commands]
+    offsets = array("i", accumulate((len(c) + 1 for c in lowered), initial=0))
+    return commands, "\n".join(lowered), offsets
+
+
+@cache
+def get_default_css_provider() -> Gtk.CssProvider:
+    """Return the provider for the default CSS, parsed once."""
+    provider = Gtk.CssProvider()
+    provider.load_from_data(DEFAULT_CSS)
+    return provider
+
+
+@lru_cache(maxsize=64)
+def subseqpattern(sub: str) -> re.Pattern[str]:
+    """Compile a regex matching lines that contain `sub` as a subsequence."""
+    return re.compile(
+        "^" + "".join(f"[^\\n{re.escape(c)}]*{re.escape(c)}" for c in sub),
+        re.MULTILINE,
     )
 
 
-def subseqmatch(sub: str, full: str) -> bool:
-    """Check if `sub` is a subsequence of `full`."""
-    if not sub:
-        return False
-    pos = -1
-    for c in sub:
-        pos = full.find(c, pos + 1)
-        if pos == -1:
-            return False
-    return True
+def split_cmdline(cmdline: str) -> list[str]:
+    """Split a command line into argv, raising ValueError if it needs a shell."""
+    argv = shlex.split(cmdline)
+    if not argv or SHELL_CHARS.intersection(cmdline) or "=" in argv[0]:
+        msg = "command line needs a shell"
+        raise ValueError(msg)
+    return argv
+
+
+def spawn(argv: list[str]) -> None:
+    """Start a process in a new session without going through a shell."""
+    # Restore signals Python ignores, as `subprocess` does with `restore_signals`
+    os.posix_spawnp(
+        argv[0],
+        argv,
+        os.environ,
+        setsid=True,
+        setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+    )
 
 
 class Launcher(Gtk.Application):
@@ -60,10 +158,36 @@ class Launcher(Gtk.Application):
 
     def __init__(self) -> None:
         super().__init__(application_id=f"app.{APP_NAME}")
-        self.commands = get_path_commands()
+        # Scan PATH in the background while the UI is being built
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._index = executor.submit(index_commands)
+        executor.shutdown(wait=False)
+        # Command indices matching the previous query, and the blob offset
+        # where its scan stopped, reused when the text is extended
+        self._last_text = ""
+        self._last_hits: list[int] = []
+        self._last_pos = 0
+        self._pending_source = 0
         self.entry: Gtk.Entry
         self.scroller: Gtk.ScrolledWindow
         self.suggestion_box: Gtk.Box
+        self.suggestion_buttons: list[Gtk.Button]
+        self.shown_suggestions: list[str]
+
+    @property
+    def commands(self) -> list[str]:
+        """PATH commands, sorted with shorter names first."""
+        return self._index.result()[0]
+
+    @property
+    def blob(self) -> str:
+        """Lowercased commands, one per line, scanned by a single regex."""
+        return self._index.result()[1]
+
+    @property
+    def offsets(self) -> array:
+        """Offset of each command's line in the blob."""
+        return self._index.result()[2]
 
     # ------------------------
     # Application lifecycle
@@ -83,7 +207,7 @@ class Launcher(Gtk.Application):
 
     def configure_style(self) -> None:
         """Load CSS file or fallback to default."""
-        css_path = get_config_path() / CSS_FILE
+        css_path = CONFIG_PATH / CSS_FILE
 
         if css_path.exists():
             css_config = Gtk.CssProvider()
@@ -96,38 +220,9 @@ class Launcher(Gtk.Application):
             )
 
         # Fallback default CSS
-        default_css = b"""
-            window {
-                min-height: 50px;
-            }
-
-            entry {
-                min-width: 500px;
-                font-size: 18px;
-                font-weight: bold;
-                border: 2px solid rgb(0, 129, 194);
-                outline-color: rgba(0, 0, 0, 0);
-                border-radius: 10px;
-            }
-
-            button {
-                font-size: 18px;
-                font-weight: bold;
-                border-radius: 18px;
-            }
-
-            button:focus {
-                border: 2px solid rgb(0, 129, 194);
-                outline-color: rgba(0, 0, 0, 0);
-            }
-        """
-
-        css_fallback = Gtk.CssProvider()
-        css_fallback.load_from_data(default_css)
-
         Gtk.StyleContext.add_provider_for_display(
             Gdk.Display.get_default(),
-            css_fallback,
+            get_default_css_provider(),
             Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION,
         )
 
@@ -182,6 +277,25 @@ class Launcher(Gtk.Application):
         self.scroller.set_child(self.suggestion_box)
         root_box.append(self.scroller)
 
+        # Suggestion buttons, relabeled on every refresh instead of recreated
+        self.suggestion_buttons = []
+        self.shown_suggestions = []
+        self._last_text, self._last_hits, self._last_pos = "", [], 0
+        for _ in range(MAX_SUGGESTIONS):
+            btn = Gtk.Button()
+            btn.set_can_focus(True)
+            btn.set_visible(False)
+            gesture = Gtk.GestureClick()
+            gesture.connect("pressed", self.on_btn_clicked)
+            btn.add_controller(gesture)
+
+            btn_key_controller = Gtk.EventControllerKey()
+            btn_key_controller.connect("key-pressed", self.on_btn_key_pressed)
+            btn.add_controller(btn_key_controller)
+
+            self.suggestion_box.append(btn)
+            self.suggestion_buttons.append(btn)
+
     # ------------------------
     # Entry handling
     # ------------------------
@@ -192,8 +306,12 @@ class Launcher(Gtk.Application):
         self.entry.set_text(text + char if char != "\b" else text[:-1])
 
     def focus_entry(self) -> None:
-        """Focus on entry."""
-        self.entry.grab_focus()
+        """Focus on entry with the cursor at the end."""
+        # The entry's text child holds the focus when the entry is focused
+        if self.entry.get_focus_child() is None:
+            self.entry.grab_focus()
+        elif self.entry.get_position() == self.entry.get_text_length():
+            return
         self.entry.set_position(-1)
 
     def set_cmd(self, cmd: str) -> None:
@@ -205,38 +323,84 @@ class Launcher(Gtk.Application):
     # ------------------------
 
     def on_entry_changed(self, entry: Gtk.Entry) -> None:
-        """Update suggestion list when entry text changes."""
-        text = entry.get_text()
-        self.refresh_suggestions(text)
+        """Schedule a suggestion update, coalescing bursts of changes."""
+        if self._pending_source:
+            GLib.source_remove(self._pending_source)
+        self._pending_source = GLib.timeout_add(
+            REFRESH_DELAY_MS,
+            self.on_refresh_timeout,
+        )
 
-    def refresh_suggestions(self, text: str) -> None:
-        """Rebuild suggestion buttons matching the input text."""
-        child = self.suggestion_box.get_first_child()
-        while child:
-            next_child = child.get_next_sibling()
-            self.suggestion_box.remove(child)
-            child = next_child
+    def on_refresh_timeout(self) -> bool:
+        """Update suggestion list from the current entry text."""
+        self._pending_source = 0
+        self.refresh_suggestions(self.entry.get_text())
+        return GLib.SOURCE_REMOVE
 
-        matches = [cmd for cmd in self.commands if subseqmatch(text, cmd.lower())]
+    def refresh_suggestions(self, text: str) -> None:
+        """Update suggestion buttons matching the input text."""
+        # Suggestions for the same text are already shown
+        if text == self._last_text:
+            return
 
-        if not matches:
+        if not text:
+            self._last_text, self._last_hits, self._last_pos = "", [], 0
+            self.shown_suggestions = []
             self.hide_suggestions()
             return
 
-        self.show_suggestions()
+        hits = self.find_hits(text)
+        commands = self.commands
+        matches = [commands[i] for i in hits]
 
-        for cmd in matches[:20]:
-            btn = Gtk.Button(label=cmd)
-            btn.set_can_focus(True)
-            gesture = Gtk.GestureClick()
-            gesture.connect("pressed", self.on_btn_clicked, cmd)
-            btn.add_controller(gesture)
+        if matches == self.shown_suggestions:
+            return
+        self.shown_suggestions = matches
 
-            btn_key_controller = Gtk.EventControllerKey()
-            btn_key_controller.connect("key-pressed", self.on_btn_key_pressed)
-            btn.add_controller(btn_key_controller)
+        if not matches:
+            self.hide_suggestions()
+            return
 
-            self.suggestion_box.append(btn)
+        self.show_suggestions()
+        self.show_matches(matches)
+
+    def find_hits(self, text: str) -> list[int]:
+        """Return indices of the first commands matching the non-empty text."""
+        # Commands never contain newlines, and one would match a line break
+        if "\n" in text:
+            self._last_text, self._last_hits, self._last_pos = text, [], len(self.blob)
+            return []
+
+        # Appending to the text can only narrow the previous matches, and
+        # nothing before the previous stopping point can newly match
+        pattern = subseqpattern(text)
+        blob, offsets = self.blob, self.offsets
+        if text.startswith(self._last_text):
+            hits = [i for i in self._last_hits if pattern.match(blob, offsets[i])]
+            pos = self._last_pos
+        else:
+            hits, pos = [], 0
+
+        # Stop at the first few matches; commands are sorted by relevance
+        if len(hits) < MAX_SUGGESTIONS:
+            for m in pattern.finditer(blob, pos):
+                hits.append(bisect_left(offsets, m.start()))
+                if len(hits) == MAX_SUGGESTIONS:
+                    pos = m.end()
+                    break
+            else:
+                pos = len(blob)
+        self._last_text, self._last_hits, self._last_pos = text, hits, pos
+        return hits
+
+    def show_matches(self, matches: list[str]) -> None:
+        """Relabel suggestion buttons with matches and hide the unused ones."""
+        for i, btn in enumerate(self.suggestion_buttons):
+            if i < len(matches):
+                btn.set_label(matches[i])
+                btn.set_visible(True)
+            else:
+                btn.set_visible(False)
 
     def show_suggestions(self) -> None:
         self.scroller.set_visible(True)
@@ -325,8 +489,8 @@ class Launcher(Gtk.Application):
         _n_press: int,
         _x: float,
         _y: float,
-        cmd: str,
     ) -> None:
+        cmd = gesture.get_widget().get_label()
         state = gesture.get_current_event_state()
         # `Ctrl+Click` to pick suggestion
         if state == Gdk.ModifierType.CONTROL_MASK:
@@ -343,14 +507,22 @@ class Launcher(Gtk.Application):
 
     def exec_one(self, cmd: str) -> None:
         """Execute a single command without arguments."""
-        subprocess.Popen(shlex.quote(cmd), shell=True)
+        try:
+            spawn([cmd])
+        except OSError:
+            # Fall back to the shell for scripts without a shebang
+            subprocess.Popen(shlex.quote(cmd), shell=True, start_new_session=True)
 
     def on_activate_entry(self, entry: Gtk.Entry) -> None:
         """Run the entered command."""
         cmdline = entry.get_text().strip()
         if not cmdline:
             return
-        subprocess.Popen(cmdline, shell=True)
+        try:
+            spawn(split_cmdline(cmdline))
+        except (ValueError, OSError):
+            # Fall back to the shell for its syntax and error reporting
+            subprocess.Popen(cmdline, shell=True, start_new_session=True)
         self.quit()
 
 